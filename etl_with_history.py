@@ -1,14 +1,23 @@
-from web3 import Web3
+from web3 import AsyncWeb3, WebSocketProvider
+from web3.exceptions import ProviderConnectionError, Web3RPCError
+from websockets.exceptions import ConnectionClosed
+import aiohttp
+from eth_abi import decode
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
-from sqlalchemy import Column,BigInteger, Numeric, String, DateTime, Integer, func
+from sqlalchemy import Column,BigInteger, Numeric, String, DateTime, Integer, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime, timezone
-import time 
+from decimal import Decimal
+import asyncio
+import io
+import pandas as pd
 import os
 from dotenv import load_dotenv
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
 
 # получаем ключи через os.getenv
 env_path = Path.cwd() / '.env' 
@@ -16,19 +25,27 @@ load_dotenv(env_path)
 
 RPC_URL = os.getenv("RPC_URL")
 DB_URL = os.getenv("DB_URL")
+WS_RPC_URL = os.getenv("WS_RPC_URL") # WebSocket-адрес узла для подписки на новые блоки в live-режиме
 
 if not RPC_URL:
     raise ValueError("RPC_URL не найден в переменных окружения!")
 
+if not WS_RPC_URL:
+    raise ValueError("WS_RPC_URL не найден в переменных окружения!")
+
 PROXY_ADDRESS = "0x8ECC0B419dfe3AE197BC96f2a03636b5E1BE91db"
 
 # Блок создания контракта = 17556156 (можно найти на Etherscan во вкладке Internal Txns)
 DEPLOYMENT_BLOCK = 23356156 # получилось загрузить исторические данные только с этого блока  
 
+# Общая HTTP-сессия с keep-alive для внешних API (RPC ходит через aiohttp-сессию AsyncHTTPProvider)
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
 # Для того чтобы узнать TLV в $ 
 def get_usd_price(token_symbol):
     url = f"https://api.coingecko.com/api/v3/simple/price?ids={token_symbol.lower()}&vs_currencies=usd"
-    response = requests.get(url).json()
+    response = http_session.get(url).json()
     return response.get(token_symbol.lower(), {}).get('usd', 0)
 
 PRICE = get_usd_price("ethereum")
@@ -40,95 +57,277 @@ ABI = [
     {"inputs": [], "name": "decimals", "outputs": [{"type": "uint8"}], "stateMutability": "view", "type": "function"}
 ]
 
+# Multicall3 задеплоен по одному адресу во всех сетях, позволяет объединить несколько eth_call в один
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [{"components": [{"name": "target", "type": "address"}, {"name": "callData", "type": "bytes"}], "name": "calls", "type": "tuple[]"}],
+        "name": "aggregate",
+        "outputs": [{"name": "blockNumber", "type": "uint256"}, {"name": "returnData", "type": "bytes[]"}],
+        "stateMutability": "payable",
+        "type": "function"
+    },
+    {"inputs": [], "name": "getCurrentBlockTimestamp", "outputs": [{"name": "timestamp", "type": "uint256"}], "stateMutability": "view", "type": "function"}
+]
+
+# Порядок колонок для загрузки в vault_metrics
+METRIC_COLUMNS = ['timestamp', 'block_number', 'tvl_assets', 'share_price', 'raw_total_assets']
+
+# Точность цены доли: 18 знаков после запятой, как у самих токенов
+SHARE_PRICE_DECIMALS = 18
+
 Base = declarative_base()
 
 class VaultMetric(Base):
     __tablename__ = 'vault_metrics'
-    id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    block_number = Column(BigInteger, unique=True, primary_key=True) #добавила номер блока в ключ 
+    __table_args__ = (UniqueConstraint('block_number', name='uq_vault_metrics_block'),) # один блок - одна запись
+    id = Column(Integer, primary_key=True, autoincrement=True) # в составном ключе SERIAL нужно указать явно
+    timestamp = Column(DateTime(timezone=True), server_default=func.now()) # обычно передаем время блока, now() - только запасной вариант
+    block_number = Column(BigInteger, primary_key=True) #добавила номер блока в ключ 
     tvl_assets = Column(Numeric)  # Сумма активов в токенах
-    share_price = Column(Numeric) # Стоимость 1 доли
+    share_price = Column(Numeric(38, 18)) # Стоимость 1 доли
     raw_total_assets = Column(String) # Сохраняем сырое значение на всякий случай
 
 
 class VaultETL:
     def __init__(self):
-        self.w3 = Web3(Web3.HTTPProvider(RPC_URL))
-        self.engine = create_engine(DB_URL)
+        self.w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_URL))
+        # executemany через psycopg2: INSERT ... VALUES по 1000 строк на страницу вместо N отдельных INSERT
+        self.engine = create_engine(
+            DB_URL,
+            executemany_mode="values_plus_batch",
+            insertmanyvalues_page_size=1000,
+            executemany_batch_page_size=500
+        )
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
         self.contract = self.w3.eth.contract(
             address=self.w3.to_checksum_address(PROXY_ADDRESS), 
             abi=ABI
         )
+        self.multicall = self.w3.eth.contract(
+            address=self.w3.to_checksum_address(MULTICALL3_ADDRESS),
+            abi=MULTICALL3_ABI
+        )
+        # Calldata для view-функций без аргументов не меняется, поэтому весь запрос к Multicall3 кодируем один раз
+        calls = [
+            (self.contract.address, self.contract.encode_abi("totalAssets")),
+            (self.contract.address, self.contract.encode_abi("totalSupply")),
+            (self.multicall.address, self.multicall.encode_abi("getCurrentBlockTimestamp")) # время блока берем из того же вызова вместо get_block
+        ]
+        self._aggregate_tx = {'to': self.multicall.address, 'data': self.multicall.encode_abi("aggregate", args=[calls])}
+        # decimals не меняется после деплоя, запрашиваем один раз в load_decimals
+        self._decimals = None
+        self._scale = None
+
+    async def load_decimals(self):
+        """Запрашивает decimals один раз и кеширует множитель для нормализации"""
+        self._decimals = await self.contract.functions.decimals().call()
+        self._scale = 10 ** self._decimals
 
-    def get_data_at_block(self, block_number):
+    async def get_data_at_block(self, block_number):
         """Вспомогательная функция для извлечения данных на любом блоке"""
-        raw_assets = self.contract.functions.totalAssets().call(block_identifier=block_number)
-        raw_supply = self.contract.functions.totalSupply().call(block_identifier=block_number)
-        decimals = self.contract.functions.decimals().call()
-        
-        
-        block_info = self.w3.eth.get_block(block_number)
-        dt = datetime.fromtimestamp(block_info['timestamp'], tz=timezone.utc)
+        if self._scale is None:
+            await self.load_decimals()
+
+        # Один eth_call через Multicall3 вместо отдельного запроса на каждую функцию.
+        # Готовый calldata отправляем напрямую, минуя ContractFunction и повторное кодирование
+        raw = await self.w3.eth.call(self._aggregate_tx, block_identifier=block_number)
+        _, return_data = decode(['uint256', 'bytes[]'], raw)
+        raw_assets, raw_supply, block_timestamp = (decode(['uint256'], data)[0] for data in return_data)
+
+        dt = datetime.fromtimestamp(block_timestamp, tz=timezone.utc)
         
-        return VaultMetric(
+        # Возвращаем словарь, а не ORM-объект; TVL считается потом для всех строк сразу в transform
+        return dict(
             timestamp=dt,
             block_number=block_number,
-            tvl_assets=raw_assets * PRICE / (10**decimals),
-            share_price=raw_assets / raw_supply if raw_supply > 0 else 1.0
+            share_price=self._share_price(raw_assets, raw_supply),
+            raw_total_assets=str(raw_assets)
         )
 
-    def backfill_history(self, step=10000):
-        """Собирает историю, если база пуста"""
-        session = self.Session()
-        # Проверяем, есть ли уже записи
-        count = session.query(func.count(VaultMetric.id)).scalar()
+    @staticmethod
+    def _share_price(raw_assets, raw_supply):
+        """Цена доли в целочисленной арифметике: без потери точности при переводе больших чисел во float"""
+        if raw_supply == 0:
+            return Decimal(1)
+        return Decimal(raw_assets * 10**SHARE_PRICE_DECIMALS // raw_supply).scaleb(-SHARE_PRICE_DECIMALS)
+
+    def tvl(self, raw_assets):
+        """TVL в $: работает и для одного значения, и для колонки DataFrame"""
+        return raw_assets * PRICE / self._scale
+
+    def transform(self, metrics):
+        """Собирает метрики в DataFrame и нормализует TVL одной векторной операцией (для Backfill)"""
+        df = pd.DataFrame(metrics, columns=['timestamp', 'block_number', 'share_price', 'raw_total_assets'])
+        df['tvl_assets'] = self.tvl(df['raw_total_assets'].astype(float))
+        return df[METRIC_COLUMNS]
+
+    def copy_metrics(self, df):
+        """Загружает пачку метрик через COPY FROM STDIN в обход ORM (только для Backfill)"""
+        buf = io.StringIO()
+        df.to_csv(buf, header=False, index=False)
+        buf.seek(0)
+
+        raw_conn = self.engine.raw_connection()
+        try:
+            with raw_conn.cursor() as cur:
+                cur.copy_expert(f"COPY vault_metrics ({', '.join(METRIC_COLUMNS)}) FROM STDIN WITH CSV", buf)
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+
+    async def fetch_blocks(self, blocks, semaphore, retries=5, backoff=1.0):
+        """Параллельно запрашивает данные по списку блоков, возвращает {block: metric}"""
+        async def fetch(block):
+            # Временные ошибки (rate limit, таймауты RPC) повторяем с экспоненциальной паузой,
+            # остальные (revert, ошибка декодирования) сразу пробрасываем
+            for attempt in range(retries):
+                try:
+                    async with semaphore:
+                        return await self.get_data_at_block(block)
+                except Exception as e:
+                    if attempt == retries - 1 or not self._is_transient(e):
+                        raise
+                    await asyncio.sleep(backoff * 2 ** attempt)
+
+        results = await asyncio.gather(*(fetch(b) for b in blocks), return_exceptions=True)
+        metrics = {}
+        for block, metric in zip(blocks, results):
+            if isinstance(metric, Exception):
+                print(f"Ошибка на блоке {block}: {metric}")
+                continue
+            metrics[block] = metric
+        return metrics
+
+    @staticmethod
+    def _is_transient(error):
+        """Проверяет, стоит ли повторить запрос после ошибки"""
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status == 429 or error.status >= 500
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ProviderConnectionError)):
+            return True
+        if isinstance(error, Web3RPCError):
+            # Infura отвечает на превышение лимита JSON-RPC ошибкой -32005
+            code = ((error.rpc_response or {}).get('error') or {}).get('code')
+            return code in (-32005, 429) or "rate limit" in str(error).lower()
+        return False
+
+    async def backfill_history(self, max_step=80000, min_step=10000, price_threshold=0.001, concurrency=20, batch_size=1000):
+        """Собирает историю, если база пуста.
+
+        Шаг адаптивный: грубый проход идет с максимальным шагом max_step (в спокойные периоды он так и остается),
+        затем интервалы, на которых цена доли изменилась больше чем на price_threshold, делятся пополам,
+        пока шаг не станет меньше min_step
+        """
+        with self.Session() as session:
+            # Проверяем, есть ли уже записи
+            count = session.query(func.count(VaultMetric.id)).scalar()
         
         if count == 0:
             print("База пуста. Начинаю сбор исторической информации...")
-            current_block = self.w3.eth.get_block('latest')['number']
-            
-            # Идем от блока деплоя до текущего с шагом
-            for block in range(DEPLOYMENT_BLOCK, current_block, step):
-                try:
-                    metric = self.get_data_at_block(block)
-                    time.sleep(0.1)
-                    session.add(metric)
-                    session.commit()
-                    print(f"Исторические данные загружены: Блок {block}")
-                except Exception as e:
-                    session.rollback()
-                    print(f"Ошибка на блоке {block}: {e}")
+            current_block = (await self.w3.eth.get_block('latest'))['number']
+            # Семафор ограничивает число одновременных запросов (rate limit у Infura)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            # Идем от блока деплоя до текущего с максимальным шагом, запросы к блокам отправляем параллельно
+            coarse_blocks = range(DEPLOYMENT_BLOCK, current_block, max_step)
+            metrics = await self.fetch_blocks(coarse_blocks, semaphore)
+            await self.refine_samples(metrics, set(coarse_blocks), semaphore, min_step, price_threshold)
+
+            # Пишем пачками по batch_size строк через COPY, один commit на пачку вместо commit на каждый блок
+            df = self.transform([metrics[b] for b in sorted(metrics)])
+            for i in range(0, len(df), batch_size):
+                batch = df.iloc[i:i + batch_size]
+                self.copy_metrics(batch)
+                print(f"Исторические данные загружены: {len(batch)} блоков, до блока {batch['block_number'].iloc[-1]}")
             print("Исторический сбор завершен.")
         else:
             print(f"В базе уже есть {count} записей. Пропускаю Backfill.")
-        session.close()
 
-    def run_live(self, interval=300):
-        """Режим работы в реальном времени"""
-        print("Запуск мониторинга в реальном времени...")
+    async def refine_samples(self, metrics, attempted, semaphore, min_step, price_threshold):
+        """Делит пополам интервалы, на которых цена доли изменилась, пока они длиннее min_step.
+
+        metrics дополняется на месте. attempted - все блоки, которые уже запрашивали (в т.ч. с ошибкой),
+        повторно они не запрашиваются
+        """
+        # Уточняем только "волатильные" интервалы: в спокойные периоды лишних запросов не делаем
         while True:
-            session = self.Session()
+            sampled = sorted(metrics)
+            midpoints = [
+                (left + right) // 2
+                for left, right in zip(sampled, sampled[1:])
+                if right - left > min_step
+                and (left + right) // 2 not in attempted
+                and self._price_changed(metrics[left]['share_price'], metrics[right]['share_price'], price_threshold)
+            ]
+            if not midpoints:
+                break
+            print(f"Уточняю {len(midpoints)} интервалов с изменением цены доли")
+            attempted.update(midpoints)
+            metrics.update(await self.fetch_blocks(midpoints, semaphore))
+        return metrics
+
+    @staticmethod
+    def _price_changed(prev_price, price, threshold):
+        """Проверяет, изменилась ли цена доли относительно предыдущей больше чем на threshold"""
+        if prev_price == 0:
+            return price != 0
+        return abs(price - prev_price) / prev_price > threshold
+
+    async def run_live(self, every_n_blocks=25):
+        """Режим работы в реальном времени: узел сам присылает новые блоки (newHeads),
+        метрика снимается не чаще чем раз в every_n_blocks блоков (25 блоков ~ 5 минут)"""
+        print("Запуск мониторинга в реальном времени...")
+        last_block = None
+        # При обрыве соединения итератор переподключается к узлу; остальные ошибки не глотаем,
+        # иначе повторяющаяся ошибка (например, узел не поддерживает eth_subscribe) превратится в бесконечный цикл
+        async for ws in AsyncWeb3(WebSocketProvider(WS_RPC_URL)):
             try:
-                latest_block = self.w3.eth.get_block('latest')['number']
-                metric = self.get_data_at_block(latest_block)
-                session.add(metric)
-                session.commit()
-                print(f"Новая метрика: {metric.timestamp} | TVL: {metric.tvl_assets:.2f}")
-            except Exception as e:
-                session.rollback()
-                if "unique constraint" not in str(e).lower(): # Игнорируем если блок тот же
-                    print(f"Ошибка Live-мониторинга: {e}")
-            finally:
-                session.close()
-            time.sleep(interval)
+                await ws.eth.subscribe("newHeads")
+                async for response in ws.socket.process_subscriptions():
+                    block_number = response['result']['number']
+                    if last_block is not None and block_number - last_block < every_n_blocks:
+                        continue
+                    last_block = block_number
+                    await self.process_block(block_number)
+            except (ConnectionClosed, ProviderConnectionError) as e:
+                print(f"Соединение с узлом потеряно, переподключаюсь: {e}")
 
-if __name__ == "__main__":
+    async def process_block(self, block_number):
+        """Снимает метрику на блоке и записывает ее в БД"""
+        try:
+            metric = await self.get_data_at_block(block_number)
+            # Одна строка: считаем TVL напрямую, без DataFrame
+            metric['tvl_assets'] = self.tvl(int(metric['raw_total_assets']))
+            # SQLAlchemy синхронный, пишем в отдельном потоке, чтобы не блокировать event loop
+            if await asyncio.to_thread(self.save_metric, metric):
+                print(f"Новая метрика: {metric['timestamp']} | TVL: {metric['tvl_assets']:.2f}")
+        except Exception as e:
+            print(f"Ошибка Live-мониторинга: {e}")
+
+    def save_metric(self, metric):
+        """Записывает одну метрику, возвращает True если строка добавлена"""
+        with self.Session() as session:
+            # Если блок уже записан, INSERT просто ничего не делает
+            stmt = insert(VaultMetric).values(**metric).on_conflict_do_nothing(index_elements=['block_number'])
+            result = session.execute(stmt)
+            session.commit()
+            return bool(result.rowcount)
+
+
+async def main():
     etl = VaultETL()
+    await etl.load_decimals()
     # 1. Сначала проверяем историю (выполнится один раз за все время существования БД)
-    # etl.backfill_history(step=10000) # Шаг ~1.5 дня (1 блок ~12 сек)
-    etl.backfill_history(step=50000) # Примерно каждые 7 дней 
+    # await etl.backfill_history(max_step=10000, min_step=10000) # Фиксированный шаг ~1.5 дня (1 блок ~12 сек)
+    await etl.backfill_history(max_step=200000, min_step=25000) # В спокойные периоды ~28 дней, в волатильные до ~3.5 дней
     # 2. Переходим к постоянному мониторингу
-    etl.run_live(interval=300)
+    await etl.run_live(every_n_blocks=25)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import requests_cache
+from requests.adapters import HTTPAdapter
+import json
+import os
+import sys
+from dotenv import load_dotenv
+from pathlib import Path
+
+# получаем ключи через os.getenv
+env_path = Path.cwd() / '.env' 
+load_dotenv(env_path)
+
+ETHERSCAN_API_KEY = os.getenv("ETHERSCAN_API_KEY")
+
+IMPLEMENTATION = "0xE66f6a37C807F71591854e22075b3A613B46abe2" # адрес волта с кодом (не прокси)
+
+# Адрес контракта можно передать аргументом: python fetch_contract.py <address>
+address = sys.argv[1] if len(sys.argv) > 1 else IMPLEMENTATION
+
+url = "https://api.etherscan.io/v2/api"
+
+params = {
+    "chainid": 1,                     
+    "module": "contract",
+    "action": "getsourcecode",
+    "address": address,
+    "apikey": ETHERSCAN_API_KEY
+}
+
+# Одна сессия с пулом соединений: TCP/TLS handshake не повторяется на каждый запрос.
+# Ответы кешируются на диске (SQLite) на сутки, повторный запуск для того же адреса в сеть не ходит.
+# Etherscan отдает ошибки (rate limit, неверный ключ) с HTTP 200, поэтому кешируем только ответы со status == "1"
+session = requests_cache.CachedSession(
+    "etherscan_cache",
+    expire_after=86400,
+    filter_fn=lambda r: r.ok and r.json().get("status") == "1"
+)
+session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
+response = session.get(url, params=params).json()
+if response.get("status") != "1":
+    sys.exit(f"Ошибка Etherscan: {response.get('message')} - {response.get('result')}")
+result = response["result"][0]
+
+# ABI
+with open("abi.json", "w") as f:
+    json.dump(json.loads(result["ABI"]), f, indent=2)
+
+# Исходный код
+source = result["SourceCode"]
+
+# Вместо pprint всего ответа (мегабайты исходников) выводим только размеры
+print(f"Получено {len(source)} байт исходного кода, {len(result.get('ABI', ''))} символов ABI")
+
+os.makedirs("contracts", exist_ok=True)
+
+# Если контракт состоит из нескольких файлов
+if source.startswith("{"):
+    sources = json.loads(source[1:-1])["sources"]
+    for path, data in sources.items():
+        filename = path.replace("/", "_")
+        with open(f"contracts/{filename}", "w") as f:
+            f.write(data["content"])
+else:
+    # Один файл
+    with open("contracts/Contract.sol", "w") as f:
+        f.write(source)
+
+print("Код и ABI скачаны")
@@ -0,0 +1,28 @@
+import os
+import sys
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("RPC_URL", "http://localhost:8545")
+os.environ.setdefault("WS_RPC_URL", "ws://localhost:8546")
+
+
+@pytest.fixture(scope="session")
+def etl_module():
+    # При импорте модуль запрашивает цену ETH в CoinGecko, подменяем ответ, чтобы не ходить в сеть
+    with mock.patch("requests.Session.get") as get:
+        get.return_value.json.return_value = {"ethereum": {"usd": 2000}}
+        import etl_with_history
+    return etl_with_history
+
+
+@pytest.fixture
+def etl(etl_module):
+    # Без __init__: тестам не нужны ни RPC, ни БД
+    instance = etl_module.VaultETL.__new__(etl_module.VaultETL)
+    instance._decimals = 18
+    instance._scale = 10**18
+    return instance
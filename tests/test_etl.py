@@ -0,0 +1,197 @@
+import asyncio
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from eth_abi import encode
+from web3.exceptions import ContractLogicError
+
+
+def fail_then_succeed(failures, error):
+    calls = []
+
+    async def fake_get_data_at_block(block):
+        calls.append(block)
+        if len(calls) <= failures:
+            raise error
+        return {'block_number': block}
+
+    return fake_get_data_at_block, calls
+
+
+def test_fetch_blocks_retries_transient_errors(etl):
+    etl.get_data_at_block, calls = fail_then_succeed(2, asyncio.TimeoutError())
+
+    metrics = asyncio.run(etl.fetch_blocks([100], asyncio.Semaphore(1), retries=5, backoff=0))
+
+    assert metrics == {100: {'block_number': 100}}
+    assert calls == [100, 100, 100]
+
+
+def test_fetch_blocks_gives_up_after_retries(etl):
+    etl.get_data_at_block, calls = fail_then_succeed(10, aiohttp.ClientConnectionError())
+
+    metrics = asyncio.run(etl.fetch_blocks([100], asyncio.Semaphore(1), retries=3, backoff=0))
+
+    assert metrics == {}
+    assert len(calls) == 3
+
+
+def test_fetch_blocks_does_not_retry_permanent_errors(etl):
+    etl.get_data_at_block, calls = fail_then_succeed(1, ContractLogicError("execution reverted"))
+
+    metrics = asyncio.run(etl.fetch_blocks([100], asyncio.Semaphore(1), retries=5, backoff=0))
+
+    assert metrics == {}
+    assert calls == [100]
+
+
+@pytest.mark.parametrize("status, expected", [(429, True), (503, True), (400, False)])
+def test_is_transient_http_status(etl_module, status, expected):
+    error = aiohttp.ClientResponseError(request_info=None, history=(), status=status)
+
+    assert etl_module.VaultETL._is_transient(error) is expected
+
+
+def sample(block, price):
+    return {'block_number': block, 'share_price': Decimal(price)}
+
+
+def test_refine_samples_stops_at_min_step(etl):
+    fetched = []
+
+    async def fake_fetch_blocks(blocks, semaphore):
+        fetched.extend(blocks)
+        # Цена растет линейно, поэтому каждый интервал считается "волатильным"
+        return {b: sample(b, 1 + Decimal(b) / 800) for b in blocks}
+
+    etl.fetch_blocks = fake_fetch_blocks
+    metrics = {0: sample(0, 1), 800: sample(800, 2)}
+    asyncio.run(etl.refine_samples(metrics, {0, 800}, None, min_step=100, price_threshold=0.001))
+
+    assert sorted(fetched) == [100, 200, 300, 400, 500, 600, 700]
+    assert len(fetched) == len(set(fetched))
+    assert sorted(metrics) == list(range(0, 801, 100))
+
+
+def test_refine_samples_skips_quiet_intervals(etl):
+    fetched = []
+
+    async def fake_fetch_blocks(blocks, semaphore):
+        fetched.extend(blocks)
+        return {}
+
+    etl.fetch_blocks = fake_fetch_blocks
+    metrics = {0: sample(0, 1), 800: sample(800, 1)}
+    asyncio.run(etl.refine_samples(metrics, {0, 800}, None, min_step=100, price_threshold=0.001))
+
+    assert fetched == []
+
+
+def test_refine_samples_does_not_refetch_attempted_blocks(etl):
+    calls = []
+
+    async def fake_fetch_blocks(blocks, semaphore):
+        calls.append(list(blocks))
+        return {} # все запросы завершаются ошибкой
+
+    etl.fetch_blocks = fake_fetch_blocks
+    metrics = {0: sample(0, 1), 800: sample(800, 2)}
+    asyncio.run(etl.refine_samples(metrics, {0, 800}, None, min_step=100, price_threshold=0.001))
+
+    assert calls == [[400]]
+
+
+def test_refine_samples_skips_failed_coarse_blocks(etl):
+    calls = []
+
+    async def fake_fetch_blocks(blocks, semaphore):
+        calls.append(list(blocks))
+        return {}
+
+    etl.fetch_blocks = fake_fetch_blocks
+    # Блок 400 был в грубом проходе, но запрос к нему не удался
+    metrics = {0: sample(0, 1), 800: sample(800, 2)}
+    asyncio.run(etl.refine_samples(metrics, {0, 400, 800}, None, min_step=100, price_threshold=0.001))
+
+    assert calls == []
+
+
+def test_share_price_is_exact_for_large_values(etl_module):
+    raw_assets = 1234567890123456789012345678901
+    raw_supply = 1000000000000000000000000000000
+
+    price = etl_module.VaultETL._share_price(raw_assets, raw_supply)
+
+    assert price == Decimal("1.234567890123456789")
+    assert price != Decimal(raw_assets / raw_supply)
+
+
+def test_share_price_zero_supply(etl_module):
+    assert etl_module.VaultETL._share_price(10**30, 0) == Decimal(1)
+
+
+def test_get_data_at_block_decodes_multicall_response(etl):
+    raw_assets = 1034006906156064612345678
+    raw_supply = 1000000000000000000000000
+    block_timestamp = 1700000000
+    requests = []
+
+    async def fake_call(tx, block_identifier):
+        requests.append((tx, block_identifier))
+        return_data = [encode(['uint256'], [value]) for value in (raw_assets, raw_supply, block_timestamp)]
+        return encode(['uint256', 'bytes[]'], [block_identifier, return_data])
+
+    etl.w3 = SimpleNamespace(eth=SimpleNamespace(call=fake_call))
+    etl._aggregate_tx = {'to': '0xcA11bde05977b3631167028862bE2a173976CA11', 'data': '0x'}
+
+    metric = asyncio.run(etl.get_data_at_block(23356156))
+
+    assert requests == [(etl._aggregate_tx, 23356156)]
+    assert metric['block_number'] == 23356156
+    assert metric['raw_total_assets'] == str(raw_assets)
+    assert metric['share_price'] == Decimal("1.034006906156064612")
+    assert metric['timestamp'] == datetime.fromtimestamp(block_timestamp, tz=timezone.utc)
+
+
+def test_transform_uses_copy_column_order(etl, etl_module):
+    metrics = [{
+        'timestamp': None,
+        'block_number': 1,
+        'share_price': Decimal(1),
+        'raw_total_assets': str(2 * 10**18)
+    }]
+
+    df = etl.transform(metrics)
+
+    assert list(df.columns) == etl_module.METRIC_COLUMNS
+    assert df['tvl_assets'].iloc[0] == 2 * etl_module.PRICE
+
+
+def test_process_block_computes_tvl_without_dataframe(etl, etl_module):
+    timestamp = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    saved = []
+
+    async def fake_get_data_at_block(block):
+        return {
+            'timestamp': timestamp,
+            'block_number': block,
+            'share_price': Decimal(1),
+            'raw_total_assets': str(3 * 10**18)
+        }
+
+    etl.get_data_at_block = fake_get_data_at_block
+    etl.save_metric = lambda metric: saved.append(metric) or True
+
+    asyncio.run(etl.process_block(42))
+
+    assert saved == [{
+        'timestamp': timestamp,
+        'block_number': 42,
+        'share_price': Decimal(1),
+        'raw_total_assets': str(3 * 10**18),
+        'tvl_assets': 3 * etl_module.PRICE
+    }]
+    assert type(saved[0]['timestamp']) is datetime